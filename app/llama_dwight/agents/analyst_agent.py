@@ -1,14 +1,33 @@
-from typing import Optional
+import logging
+import threading
+from typing import Callable, Literal, Optional
 from langchain_core.language_models.chat_models import BaseChatModel
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage
+from langchain_core.runnables.config import RunnableConfig
 from langgraph.graph.state import StateGraph, END, CompiledStateGraph
 from langgraph.checkpoint import BaseCheckpointSaver
 from langgraph.graph.message import MessagesState
 
+from llama_dwight.checkpoint import BasePayloadStore, offload_tool_messages
 from llama_dwight.tools.base import BaseDataToolKit
-from llama_dwight.tools.types import ToolName
+from llama_dwight.tools.types import AnalysisPlan, ToolName
 from llama_dwight.agents.qa_agent import make_qa_agent
+from llama_dwight.agents.plan_executor import (
+    execute_plan,
+    get_structured_plan,
+    make_plan_message,
+    phrase_answer,
+)
+from llama_dwight.agents.routing import CallType, ModelRouter
+from llama_dwight.agents.sessions import (
+    Session,
+    SessionStore,
+    get_session_id,
+    get_thread_id,
+)
+from llama_dwight.agents.speculation import Speculator
 
+logger = logging.getLogger(__name__)
 
 PLAN_SYSTEM_PROMPT = """You are an experienced data analyst that has access to a dataset with the following schema: {schema}."
 You need to help a junior data analyst answer the following question: {question}.
@@ -32,50 +51,230 @@ class AnalystAgent:
         llm: BaseChatModel,
         data_toolkit: Optional[BaseDataToolKit] = None,
         checkpointer: Optional[BaseCheckpointSaver] = None,
+        use_structured_plan: bool = False,
+        payload_store: Optional[BasePayloadStore] = None,
+        sessions: Optional[SessionStore] = None,
+        small_llm: Optional[BaseChatModel] = None,
+        speculator: Optional[Speculator] = None,
     ) -> None:
         self.llm = llm
+        # if small_llm is set, it's used instead of llm for the calls that don't need a large model
+        self.router = ModelRouter(llm, small_llm)
+        # shared, read-only dataset. Each thread gets its own session toolkit on top of it
         self.data_toolkit = data_toolkit
-        self.qa_agent = (
-            None if data_toolkit is None else make_qa_agent(llm, data_toolkit)
-        )
         self.checkpointer = checkpointer
+        # if enabled, the planner will also emit a structured plan that can be executed
+        # directly against the toolkit, without the ReAct loop in the QA agent
+        self.use_structured_plan = use_structured_plan
+        # if set, large tool outputs are moved out of the graph state (and checkpoints)
+        self.payload_store = payload_store
+        self.sessions = SessionStore() if sessions is None else sessions
+        # datasets loaded from the graph state, keyed by data source
+        self.datasets: dict[str, BaseDataToolKit] = {}
+        self._datasets_lock = threading.Lock()
+        # if set, the plan is executed in the background while it's being reviewed
+        self.speculator = speculator
 
-    def load_data_toolkit(self, state: MessagesState) -> MessagesState:
+    def load_dataset(self, state: MessagesState) -> BaseDataToolKit:
+        """Load the dataset specified in the graph state."""
         raise NotImplementedError
 
-    def create_plan(self, state: MessagesState) -> MessagesState:
-        if self.data_toolkit is None:
-            raise ValueError("Cannot create a plan without a data toolkit")
+    def get_or_load_dataset(
+        self, key: str, load: Callable[[], BaseDataToolKit]
+    ) -> BaseDataToolKit:
+        with self._datasets_lock:
+            if key not in self.datasets:
+                self.datasets[key] = load()
+
+            return self.datasets[key]
+
+    def create_session(self, state: MessagesState) -> Session:
+        if self.data_toolkit is not None:
+            dataset = self.data_toolkit
+        else:
+            dataset = self.load_dataset(state)
+
+        data_toolkit = dataset.new_session()
+        return Session(
+            data_toolkit, make_qa_agent(self.llm, data_toolkit, router=self.router)
+        )
+
+    def get_session(self, state: MessagesState, config: RunnableConfig) -> Session:
+        # sessions are re-created if they were closed, e.g. when resuming an idle thread
+        return self.sessions.get_or_create(
+            get_session_id(config), lambda: self.create_session(state)
+        )
+
+    def close_run_session(self, config: RunnableConfig) -> None:
+        """Close the throwaway session of a run without a thread ID, once the run is done."""
+        if get_thread_id(config) is None:
+            self.sessions.close(get_session_id(config))
 
-        schema = self.data_toolkit.get_schema()
+    def load_data_toolkit(
+        self, state: MessagesState, config: RunnableConfig
+    ) -> MessagesState:
+        self.sessions.close_idle()
+        if self.speculator is not None and get_thread_id(config) is not None:
+            self.speculator.discard_stale()
+            self.speculator.discard(get_thread_id(config))
+
+        session = self.get_session(state, config)
+        # pick up any appended data, clear toolkit state and continue
+        session.data_toolkit.refresh()
+        session.data_toolkit.clear()
+        return state
+
+    def create_plan(
+        self, state: MessagesState, config: RunnableConfig
+    ) -> MessagesState:
+        plan_message = self._create_plan(state, config)
+        # runs without a thread ID can't be interrupted for a review
+        if self.speculator is not None and get_thread_id(config) is not None:
+            self.start_speculation(
+                {**state, "messages": [*state["messages"], plan_message]}, config
+            )
+        return {"messages": [plan_message]}
+
+    def _create_plan(self, state: MessagesState, config: RunnableConfig) -> AnyMessage:
+        data_toolkit = self.get_session(state, config).data_toolkit
+        schema = data_toolkit.get_schema()
         question = state["messages"][-1].content
-        available_tools = [tool.name for tool in self.data_toolkit.get_tools()]
+        available_tools = [tool.name for tool in data_toolkit.get_tools()]
         system_message = SystemMessage(
             content=PLAN_SYSTEM_PROMPT.format(
                 schema=schema, question=question, available_tools=available_tools
             )
         )
         human_message = HumanMessage(content=PLAN_MESSAGE)
-        response = self.llm.invoke([system_message, human_message])
-        return {"messages": [response]}
+        tier = self.router.route(CallType.PLAN, question, schema)
+        llm = self.router.get_llm(tier)
+        if self.use_structured_plan:
+            try:
+                plan = llm.with_structured_output(AnalysisPlan).invoke(
+                    [system_message, human_message]
+                )
+            except Exception:
+                logger.exception("Failed to create a structured plan")
+                plan = None
+
+            # fall back to a regular plan if the structured one couldn't be produced
+            if plan is not None:
+                return make_plan_message(plan)
+
+        return llm.invoke([system_message, human_message])
+
+    def start_speculation(self, state: MessagesState, config: RunnableConfig) -> None:
+        """Execute the unedited plan in the background, on a snapshot of the session toolkit."""
+        # speculative runs can be discarded, so they shouldn't influence index creation
+        data_toolkit = self.get_session(state, config).data_toolkit.new_session(
+            record_workload=False
+        )
+
+        def run() -> list[AnyMessage]:
+            # speculative work only touches its own toolkit session, so that nothing
+            # leaks into the committed state if the plan is edited
+            try:
+                if get_structured_plan(state["messages"][-1]) is not None:
+                    return self.run_plan_executor(state, data_toolkit)
+
+                qa_agent = make_qa_agent(self.llm, data_toolkit, router=self.router)
+                return self.run_qa_agent(state, qa_agent)
+            finally:
+                data_toolkit.close()
+
+        self.speculator.start(get_thread_id(config), state["messages"][-1], run)
+
+    def take_speculation(
+        self, state: MessagesState, config: RunnableConfig
+    ) -> Optional[list[AnyMessage]]:
+        if self.speculator is None or get_thread_id(config) is None:
+            return None
+
+        return self.speculator.take(get_thread_id(config), state["messages"][-1])
+
+    def route_plan(self, state: MessagesState) -> Literal["execute_plan", "qa_agent"]:
+        plan = get_structured_plan(state["messages"][-1])
+        if plan is None:
+            return "qa_agent"
+
+        return "execute_plan"
+
+    def run_plan_executor(
+        self, state: MessagesState, data_toolkit: BaseDataToolKit
+    ) -> list[AnyMessage]:
+        plan = get_structured_plan(state["messages"][-1])
+        if plan is None:
+            raise ValueError("Plan message doesn't contain a valid structured plan.")
+
+        result = execute_plan(data_toolkit, plan)
+        question = next(
+            message.content
+            for message in reversed(state["messages"])
+            if message.type == "human"
+        )
+        schema = data_toolkit.get_schema()
+        tier = self.router.route(CallType.ANSWER, question, schema)
+        response = phrase_answer(
+            self.router.get_llm(tier), schema, question, plan, result
+        )
+        self.router.log_outcome(CallType.ANSWER, tier, response)
+        return [response]
+
+    def call_plan_executor(
+        self, state: MessagesState, config: RunnableConfig
+    ) -> MessagesState:
+        if (messages := self.take_speculation(state, config)) is not None:
+            return {"messages": messages}
+
+        data_toolkit = self.get_session(state, config).data_toolkit
+        try:
+            messages = self.run_plan_executor(state, data_toolkit)
+        except Exception:
+            logger.exception(
+                "Structured plan execution failed, falling back to QA agent"
+            )
+            # hand off to the QA agent, which can recover from tool errors
+            data_toolkit.clear()
+            return self.call_qa_agent(state, config)
+        finally:
+            self.close_run_session(config)
+
+        return {"messages": messages}
+
+    def run_qa_agent(
+        self, state: MessagesState, qa_agent: CompiledStateGraph
+    ) -> list[AnyMessage]:
+        qa_agent_response = qa_agent.invoke(state)
+        # only return the new messages, so that the plan message isn't overwritten
+        messages = qa_agent_response["messages"][len(state["messages"]) :]
+        if self.payload_store is not None:
+            messages = offload_tool_messages(messages, self.payload_store)
+        return messages
 
-    def call_qa_agent(self, state: MessagesState) -> MessagesState:
-        if self.qa_agent is None:
-            raise ValueError("Question-answering agent hasn't been initialized.")
+    def call_qa_agent(
+        self, state: MessagesState, config: RunnableConfig
+    ) -> MessagesState:
+        if (messages := self.take_speculation(state, config)) is not None:
+            return {"messages": messages}
 
-        qa_agent_response = self.qa_agent.invoke(state)
-        return {"messages": qa_agent_response["messages"]}
+        qa_agent = self.get_session(state, config).qa_agent
+        try:
+            return {"messages": self.run_qa_agent(state, qa_agent)}
+        finally:
+            self.close_run_session(config)
 
     def compile(self, should_interrupt: bool = True) -> CompiledStateGraph:
         workflow = StateGraph(self.state_schema)
         workflow.add_node("load_data", self.load_data_toolkit)
         workflow.add_node("create_plan", self.create_plan)
         workflow.add_node("qa_agent", self.call_qa_agent)
+        workflow.add_node("execute_plan", self.call_plan_executor)
         workflow.set_entry_point("load_data")
         workflow.add_edge("load_data", "create_plan")
-        workflow.add_edge("create_plan", "qa_agent")
+        workflow.add_conditional_edges("create_plan", self.route_plan)
         workflow.add_edge("qa_agent", END)
-        interrupt_before = ["qa_agent"] if should_interrupt else None
+        workflow.add_edge("execute_plan", END)
+        interrupt_before = ["qa_agent", "execute_plan"] if should_interrupt else None
         return workflow.compile(
             interrupt_before=interrupt_before, checkpointer=self.checkpointer
         )
@@ -1,12 +1,14 @@
 from langgraph.graph.message import MessagesState
 
 from llama_dwight.agents.analyst_agent import AnalystAgent
-from llama_dwight.agents.qa_agent import make_qa_agent
+from llama_dwight.checkpoint import SQLitePayloadStore
+from llama_dwight.config import IS_LANGGRAPH_API, PAYLOAD_STORE_PATH
 from llama_dwight.llms import LLMName, get_llm
 from llama_dwight.tools.pandas import PandasDataToolKit
 
 DEFAULT_FILEPATH = "data.csv"
 llm = get_llm(LLMName.GROQ_LLAMA_3_1_70B)
+small_llm = get_llm(LLMName.GROQ_LLAMA_3_1_8B)
 
 
 class PandasAnalystState(MessagesState):
@@ -18,17 +20,15 @@ class PandasAnalystState(MessagesState):
 class PandasAnalystAgent(AnalystAgent):
     state_schema = PandasAnalystState
 
-    def load_data_toolkit(self, state: PandasAnalystState) -> PandasAnalystState:
-        if self.data_toolkit is not None:
-            # clear toolkit state and continue
-            self.data_toolkit.clear()
-            return state
-
+    def load_dataset(self, state: PandasAnalystState) -> PandasDataToolKit:
         filepath = state["filepath"] or DEFAULT_FILEPATH
-        data_toolkit = PandasDataToolKit.from_filepath(filepath, preprocess=True)
-        self.data_toolkit = data_toolkit
-        self.qa_agent = make_qa_agent(self.llm, data_toolkit)
-        return state
+        return self.get_or_load_dataset(
+            filepath, lambda: PandasDataToolKit.from_filepath(filepath, preprocess=True)
+        )
 
 
-graph = PandasAnalystAgent(llm).compile()
+# keep the checkpoints in the LangGraph API compact
+payload_store = SQLitePayloadStore(PAYLOAD_STORE_PATH) if IS_LANGGRAPH_API else None
+graph = PandasAnalystAgent(
+    llm, payload_store=payload_store, small_llm=small_llm
+).compile()
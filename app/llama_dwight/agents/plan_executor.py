@@ -0,0 +1,86 @@
+import json
+from typing import Any, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, SystemMessage
+from langchain_core.pydantic_v1 import ValidationError
+
+from llama_dwight.tools.base import BaseDataToolKit
+from llama_dwight.tools.types import AnalysisPlan
+
+STRUCTURED_PLAN_KEY = "structured_plan"
+
+ANSWER_SYSTEM_PROMPT = """You are an experienced data analyst that has access to a dataset with the following schema: {schema}.
+You were asked the following question: {question}.
+You followed this plan to answer it: {plan}.
+The final step of the plan returned the following result: {result}.
+
+REMEMBER:
+- Only respond with the answer to the original question, do not mention the tools you used."""
+
+
+def make_plan_message(plan: AnalysisPlan) -> AIMessage:
+    """Make a plan message that can be reviewed by a human and carries the structured plan."""
+    return AIMessage(
+        content=plan.description,
+        additional_kwargs={STRUCTURED_PLAN_KEY: json.loads(plan.json())},
+    )
+
+
+def get_structured_plan(message: AnyMessage) -> Optional[AnalysisPlan]:
+    """Get structured plan from the plan message, if it's still valid.
+
+    The structured plan is discarded if the plan message content was edited by a human,
+    since the edit is not reflected in the structured steps.
+    """
+    structured_plan = message.additional_kwargs.get(STRUCTURED_PLAN_KEY)
+    if structured_plan is None:
+        return None
+
+    if structured_plan.get("description") != message.content:
+        return None
+
+    try:
+        return AnalysisPlan.parse_obj(structured_plan)
+    except ValidationError:
+        return None
+
+
+def execute_plan(toolkit: BaseDataToolKit, plan: AnalysisPlan) -> Any:
+    """Run the plan steps against the toolkit in a pre-defined order and return the result of the last step."""
+    result = None
+    if plan.filter is not None:
+        result = toolkit.filter(plan.filter.filters)
+
+    if plan.sort is not None:
+        result = toolkit.sort(plan.sort.column, plan.sort.ascending, plan.sort.limit)
+
+    if plan.aggregate is not None:
+        result = toolkit.aggregate(
+            plan.aggregate.columns, plan.aggregate.aggregation_func
+        )
+    elif plan.groupby is not None:
+        result = toolkit.groupby(
+            plan.groupby.groupby_columns,
+            plan.groupby.value_column,
+            plan.groupby.aggregation_func,
+            plan.groupby.freq,
+        )
+    return result
+
+
+def phrase_answer(
+    llm: BaseChatModel,
+    schema: dict,
+    question: str,
+    plan: AnalysisPlan,
+    result: Any,
+) -> AIMessage:
+    """Phrase the final answer to the question based on the plan execution result."""
+    system_message = SystemMessage(
+        content=ANSWER_SYSTEM_PROMPT.format(
+            schema=schema, question=question, plan=plan.description, result=result
+        )
+    )
+    human_message = HumanMessage(content=question)
+    return llm.invoke([system_message, human_message])
@@ -1,4 +1,4 @@
-from typing import Any, Coroutine, Union, Literal
+from typing import Any, Coroutine, Optional, Union, Literal
 
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.runnables.config import (
@@ -15,6 +15,7 @@ from langgraph.graph.state import CompiledStateGraph, StateGraph, END
 from langgraph.pregel.types import RetryPolicy
 from langgraph.prebuilt.tool_node import ToolNode
 
+from llama_dwight.agents.routing import CallType, ModelRouter, ModelTier
 from llama_dwight.tools.base import BaseDataToolKit
 from llama_dwight.tools.types import ToolName
 
@@ -79,13 +80,13 @@ class SequentialToolNode(ToolNode):
         requested_tools = set(call["name"] for call in tool_calls)
         available_tools = {value.value for value in ToolName}
         if unknown_tools := requested_tools - available_tools:
-            INVALID_TOOL_NAME_ERROR_TEMPLATE.format(
+            error_message = INVALID_TOOL_NAME_ERROR_TEMPLATE.format(
                 requested_tools=unknown_tools, available_tools=available_tools
             )
             return {
                 "messages": [
                     ToolMessage(
-                        INCORRECT_TOOL_ORDER_ERROR_MESSAGE,
+                        error_message,
                         name=call["name"],
                         tool_call_id=call["id"],
                     )
@@ -131,22 +132,41 @@ class SequentialToolNode(ToolNode):
         raise NotImplementedError
 
 
-def make_qa_agent(llm: BaseChatModel, toolkit: BaseDataToolKit) -> CompiledStateGraph:
-    """Make question-answering agent that uses an external data toolkit (pandas or DB)."""
+def make_qa_agent(
+    llm: BaseChatModel,
+    toolkit: BaseDataToolKit,
+    router: Optional[ModelRouter] = None,
+) -> CompiledStateGraph:
+    """Make question-answering agent that uses an external data toolkit (pandas or DB).
+
+    If router is provided, the model for each step is picked by the router, otherwise `llm` is used.
+    """
     schema = toolkit.get_schema()
     tools = toolkit.get_tools()
+    if router is None:
+        router = ModelRouter(llm)
 
     # add system message
     preprocessor = _get_model_preprocessing_runnable(
         SYSTEM_PROMPT.format(schema=schema), None
     )
-    model_runnable = preprocessor | llm.bind_tools(tools)
+    model_runnables = {
+        tier: preprocessor | router.get_llm(tier).bind_tools(tools)
+        for tier in ModelTier
+    }
 
     def call_model(
         state: AgentState,
         config: RunnableConfig,
     ) -> AgentState:
-        response = model_runnable.invoke(state, config)
+        question = next(
+            message.content
+            for message in reversed(state["messages"])
+            if message.type == "human"
+        )
+        tier = router.route(CallType.TOOL_STEP, question, schema, state["messages"])
+        response = model_runnables[tier].invoke(state, config)
+        router.log_outcome(CallType.TOOL_STEP, tier, response)
         if state["is_last_step"] and response.tool_calls:
             return {
                 "messages": [
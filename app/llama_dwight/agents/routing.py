@@ -0,0 +1,139 @@
+import enum
+import logging
+import re
+from typing import Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AnyMessage
+
+logger = logging.getLogger(__name__)
+
+# words that indicate the question needs a groupby / sort or multiple steps
+COMPLEX_QUESTION_KEYWORDS = frozenset(
+    {
+        "by",
+        "each",
+        "per",
+        "group",
+        "top",
+        "bottom",
+        "largest",
+        "smallest",
+        "highest",
+        "lowest",
+        "most",
+        "least",
+        "rank",
+        "compare",
+        "trend",
+        "monthly",
+        "quarterly",
+        "yearly",
+    }
+)
+# questions that mention more columns than this likely need multiple steps
+MAX_SIMPLE_QUESTION_COLUMNS = 2
+
+
+@enum.unique
+class ModelTier(str, enum.Enum):
+    SMALL = "small"
+    LARGE = "large"
+
+
+@enum.unique
+class CallType(str, enum.Enum):
+    PLAN = "plan"
+    TOOL_STEP = "tool_step"
+    ANSWER = "answer"
+
+
+@enum.unique
+class QuestionComplexity(str, enum.Enum):
+    SIMPLE = "simple"
+    COMPLEX = "complex"
+
+
+def classify_question(question: str, schema: dict) -> QuestionComplexity:
+    """Cheap heuristic classifier for how many tool steps the question needs."""
+    question = question.lower()
+    words = set(re.findall(r"[a-z0-9_]+", question))
+    if words & COMPLEX_QUESTION_KEYWORDS:
+        return QuestionComplexity.COMPLEX
+
+    n_columns = sum(column.lower() in question for column in schema)
+    if n_columns > MAX_SIMPLE_QUESTION_COLUMNS:
+        return QuestionComplexity.COMPLEX
+
+    return QuestionComplexity.SIMPLE
+
+
+def has_failed_tool_step(messages: list[AnyMessage]) -> bool:
+    """Check if any of the tool calls for the current question were rejected."""
+    for message in reversed(messages):
+        if message.type == "tool" and str(message.content).startswith("Error"):
+            return True
+
+        # reached the plan / question message
+        if message.type == "human" or (message.type == "ai" and not message.tool_calls):
+            return False
+    return False
+
+
+class ModelRouter:
+    """Pick the model for each LLM call.
+
+    Planning always uses the large model. Tool steps for simple questions and final answer
+    phrasing use the small model, falling back to the large one if a tool call is rejected.
+    """
+
+    def __init__(
+        self, large_llm: BaseChatModel, small_llm: Optional[BaseChatModel] = None
+    ) -> None:
+        self.large_llm = large_llm
+        self.small_llm = small_llm
+
+    def get_llm(self, tier: ModelTier) -> BaseChatModel:
+        if tier == ModelTier.SMALL and self.small_llm is not None:
+            return self.small_llm
+
+        return self.large_llm
+
+    def route(
+        self,
+        call_type: CallType,
+        question: str,
+        schema: dict,
+        messages: Optional[list[AnyMessage]] = None,
+    ) -> ModelTier:
+        complexity = classify_question(question, schema)
+        is_fallback = messages is not None and has_failed_tool_step(messages)
+        if self.small_llm is None or call_type == CallType.PLAN or is_fallback:
+            tier = ModelTier.LARGE
+        elif call_type == CallType.ANSWER:
+            tier = ModelTier.SMALL
+        elif complexity == QuestionComplexity.SIMPLE:
+            tier = ModelTier.SMALL
+        else:
+            tier = ModelTier.LARGE
+
+        logger.info(
+            "Routed %s call to %s model (complexity=%s, fallback=%s)",
+            call_type.value,
+            tier.value,
+            complexity.value,
+            is_fallback,
+        )
+        return tier
+
+    def log_outcome(
+        self, call_type: CallType, tier: ModelTier, response: AnyMessage
+    ) -> None:
+        tool_calls = getattr(response, "tool_calls", None)
+        if tool_calls:
+            outcome = (
+                f"requested tools {[tool_call['name'] for tool_call in tool_calls]}"
+            )
+        else:
+            outcome = "responded without tool calls"
+        logger.info("%s call on %s model %s", call_type.value, tier.value, outcome)
@@ -0,0 +1,110 @@
+import dataclasses
+import threading
+import time
+from typing import Callable, Optional
+
+from langchain_core.runnables.config import RunnableConfig
+from langgraph.graph.state import CompiledStateGraph
+
+from llama_dwight.tools.base import BaseDataToolKit
+
+# prefix of the session IDs for the runs that don't specify a thread ID (e.g. no checkpointer)
+RUN_SESSION_PREFIX = "run-"
+# sessions that weren't used for this long are closed
+DEFAULT_MAX_IDLE_SECONDS = 30 * 60
+
+
+def get_thread_id(config: Optional[RunnableConfig]) -> Optional[str]:
+    if config is None:
+        return None
+
+    # NOTE: nodes see a thread ID namespaced by the node name in "configurable",
+    # while metadata keeps the thread ID the graph was invoked with
+    thread_id = config.get("metadata", {}).get("thread_id")
+    if thread_id is None:
+        thread_id = config.get("configurable", {}).get("thread_id")
+    return None if thread_id is None else str(thread_id)
+
+
+def get_session_id(config: Optional[RunnableConfig]) -> str:
+    """Get the thread ID, or an ID for a single run if the run doesn't have a thread ID.
+
+    Runs without a thread ID can't be resumed, so they get a throwaway session
+    instead of sharing one with all the other runs.
+    """
+    thread_id = get_thread_id(config)
+    if thread_id is not None:
+        return thread_id
+
+    # the checkpoint ID in the metadata is the same for all steps of such a run
+    run_checkpoint_id = (config or {}).get("metadata", {}).get("thread_ts")
+    if run_checkpoint_id is None:
+        raise ValueError("Can't identify the session for a run without a thread ID")
+    return f"{RUN_SESSION_PREFIX}{run_checkpoint_id}"
+
+
+@dataclasses.dataclass
+class Session:
+    """Per-thread toolkit state on top of a shared dataset."""
+
+    data_toolkit: BaseDataToolKit
+    qa_agent: CompiledStateGraph
+    last_used_at: float = dataclasses.field(default_factory=time.monotonic)
+
+
+class SessionStore:
+    """Thread-safe registry of sessions, keyed by thread ID."""
+
+    def __init__(self, max_idle_seconds: float = DEFAULT_MAX_IDLE_SECONDS) -> None:
+        self.max_idle_seconds = max_idle_seconds
+        self._sessions: dict[str, Session] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, thread_id: str) -> Optional[Session]:
+        with self._lock:
+            session = self._sessions.get(thread_id)
+            if session is not None:
+                session.last_used_at = time.monotonic()
+            return session
+
+    def get_or_create(
+        self, thread_id: str, create_session: Callable[[], Session]
+    ) -> Session:
+        if (session := self.get(thread_id)) is not None:
+            return session
+
+        # create outside of the lock, since this can be slow (e.g. loading the data)
+        new_session = create_session()
+        with self._lock:
+            session = self._sessions.setdefault(thread_id, new_session)
+
+        if session is not new_session:
+            # another run for the same thread created the session first
+            new_session.data_toolkit.close()
+        return session
+
+    def close(self, thread_id: str) -> None:
+        with self._lock:
+            session = self._sessions.pop(thread_id, None)
+
+        if session is not None:
+            session.data_toolkit.close()
+
+    def close_idle(self) -> None:
+        """Close sessions that haven't been used for longer than max_idle_seconds."""
+        now = time.monotonic()
+        with self._lock:
+            idle_thread_ids = [
+                thread_id
+                for thread_id, session in self._sessions.items()
+                if now - session.last_used_at > self.max_idle_seconds
+            ]
+            idle_sessions = [
+                self._sessions.pop(thread_id) for thread_id in idle_thread_ids
+            ]
+
+        for session in idle_sessions:
+            session.data_toolkit.close()
@@ -0,0 +1,119 @@
+import dataclasses
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from langchain_core.messages import AnyMessage
+
+from llama_dwight.agents.plan_executor import get_structured_plan
+
+logger = logging.getLogger(__name__)
+
+# speculative results that weren't picked up for this long are discarded
+DEFAULT_MAX_SPECULATION_AGE_SECONDS = 30 * 60
+
+
+def get_plan_key(message: AnyMessage) -> str:
+    """Get a key for the plan message that only changes when the tool steps can change."""
+    plan = get_structured_plan(message)
+    if plan is not None:
+        # the prose description doesn't affect the steps of a structured plan
+        steps = json.loads(plan.json(exclude={"description"}))
+        return json.dumps({"structured_plan": steps}, sort_keys=True)
+
+    # ignore whitespace changes in the prose plan. Case matters, e.g. for filter values
+    normalized_content = " ".join(str(message.content).split())
+    return json.dumps({"plan": normalized_content})
+
+
+@dataclasses.dataclass
+class Speculation:
+    plan_key: str
+    # new messages produced by executing the plan
+    future: Future
+    created_at: float = dataclasses.field(default_factory=time.monotonic)
+
+
+class Speculator:
+    """Execute plans in the background while they're being reviewed, keyed by thread ID."""
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        max_age_seconds: float = DEFAULT_MAX_SPECULATION_AGE_SECONDS,
+    ) -> None:
+        self.max_age_seconds = max_age_seconds
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="speculation"
+        )
+        self._speculations: dict[str, Speculation] = {}
+        self._lock = threading.Lock()
+
+    def start(
+        self,
+        thread_id: str,
+        plan_message: AnyMessage,
+        run: Callable[[], list[AnyMessage]],
+    ) -> None:
+        """Start executing the plan in the background, replacing any previous speculation."""
+        future = self._executor.submit(run)
+        speculation = Speculation(get_plan_key(plan_message), future)
+        with self._lock:
+            previous_speculation = self._speculations.pop(thread_id, None)
+            self._speculations[thread_id] = speculation
+
+        if previous_speculation is not None:
+            previous_speculation.future.cancel()
+
+    def discard(self, thread_id: str) -> None:
+        with self._lock:
+            speculation = self._speculations.pop(thread_id, None)
+
+        if speculation is not None:
+            speculation.future.cancel()
+
+    def discard_stale(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            stale_thread_ids = [
+                thread_id
+                for thread_id, speculation in self._speculations.items()
+                if now - speculation.created_at > self.max_age_seconds
+            ]
+            stale_speculations = [
+                self._speculations.pop(thread_id) for thread_id in stale_thread_ids
+            ]
+
+        for speculation in stale_speculations:
+            speculation.future.cancel()
+
+    def take(
+        self, thread_id: str, plan_message: AnyMessage
+    ) -> Optional[list[AnyMessage]]:
+        """Get the speculative result if it was produced for an equivalent plan.
+
+        Waits for the speculation to finish if it's still running, since it's ahead
+        of a fresh execution.
+        """
+        with self._lock:
+            speculation = self._speculations.pop(thread_id, None)
+
+        if speculation is None:
+            return None
+
+        if speculation.plan_key != get_plan_key(plan_message):
+            logger.info("Discarding speculative result for an edited plan")
+            speculation.future.cancel()
+            return None
+
+        try:
+            messages = speculation.future.result()
+        except Exception:
+            logger.exception("Speculative plan execution failed")
+            return None
+
+        logger.info("Using speculative result")
+        return messages
@@ -1,12 +1,14 @@
 from langgraph.graph.message import MessagesState
 
 from llama_dwight.agents.analyst_agent import AnalystAgent
-from llama_dwight.agents.qa_agent import make_qa_agent
+from llama_dwight.checkpoint import SQLitePayloadStore
+from llama_dwight.config import IS_LANGGRAPH_API, PAYLOAD_STORE_PATH
 from llama_dwight.llms import LLMName, get_llm
 from llama_dwight.tools.sql import SQLDataToolKit
 
 DEFAULT_CONN_STRING = "sqlite:///data.db"
 llm = get_llm(LLMName.GROQ_LLAMA_3_1_70B)
+small_llm = get_llm(LLMName.GROQ_LLAMA_3_1_8B)
 
 
 class SQLAnalystState(MessagesState):
@@ -18,17 +20,15 @@ class SQLAnalystState(MessagesState):
 class SQLAnalystAgent(AnalystAgent):
     state_schema = SQLAnalystState
 
-    def load_data_toolkit(self, state: SQLAnalystState) -> SQLAnalystState:
-        if self.data_toolkit is not None:
-            # clear toolkit state and continue
-            self.data_toolkit.clear()
-            return state
-
+    def load_dataset(self, state: SQLAnalystState) -> SQLDataToolKit:
         conn_string = state["db_conn_string"] or DEFAULT_CONN_STRING
-        data_toolkit = SQLDataToolKit.from_conn_string(conn_string, state["table"])
-        self.data_toolkit = data_toolkit
-        self.qa_agent = make_qa_agent(self.llm, data_toolkit)
-        return state
+        table_name = state["table"]
+        return self.get_or_load_dataset(
+            f"{conn_string}:{table_name}",
+            lambda: SQLDataToolKit.from_conn_string(conn_string, table_name),
+        )
 
 
-graph = SQLAnalystAgent(llm).compile()
+# keep the checkpoints in the LangGraph API compact
+payload_store = SQLitePayloadStore(PAYLOAD_STORE_PATH) if IS_LANGGRAPH_API else None
+graph = SQLAnalystAgent(llm, payload_store=payload_store, small_llm=small_llm).compile()
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import zlib
+from typing import Any, Optional
+
+from langchain_core.messages import AnyMessage, ToolMessage
+from langgraph.serde.base import SerializerProtocol
+from langgraph.serde.jsonplus import JsonPlusSerializer
+
+PAYLOAD_REF_KEY = "payload_ref"
+# tool outputs larger than this are moved to the payload store
+MAX_INLINE_PAYLOAD_BYTES = 2048
+# number of characters of the tool output to keep in the message
+PAYLOAD_PREVIEW_CHARS = 256
+# marks compressed checkpoint data, can't be a prefix of valid JSON
+COMPRESSED_PREFIX = b"\x00zlib"
+
+
+def get_payload_key(payload: bytes) -> str:
+    return hashlib.sha256(payload).hexdigest()
+
+
+class BasePayloadStore:
+    """Content-addressed store for large tool outputs, referenced from the messages by key."""
+
+    def put(self, payload: bytes) -> str:
+        """Store the payload (if it's not stored yet) and return its key."""
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Get the payload by key, if it exists."""
+        raise NotImplementedError
+
+
+class LocalFilePayloadStore(BasePayloadStore):
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def put(self, payload: bytes) -> str:
+        key = get_payload_key(payload)
+        path = self._get_path(key)
+        if os.path.exists(path):
+            return key
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, so that readers never see partial payloads
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(zlib.compress(payload))
+        os.replace(tmp_path, path)
+        return key
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._get_path(key)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, "rb") as f:
+            return zlib.decompress(f.read())
+
+
+class SQLitePayloadStore(BasePayloadStore):
+    def __init__(self, path: str) -> None:
+        if directory := os.path.dirname(path):
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS payloads (key TEXT PRIMARY KEY, payload BLOB)"
+        )
+        self.conn.commit()
+        self._lock = threading.Lock()
+
+    def put(self, payload: bytes) -> str:
+        key = get_payload_key(payload)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO payloads (key, payload) VALUES (?, ?)",
+                (key, zlib.compress(payload)),
+            )
+            self.conn.commit()
+        return key
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            res = self.conn.execute(
+                "SELECT payload FROM payloads WHERE key = ?", (key,)
+            ).fetchone()
+
+        if res is None:
+            return None
+
+        return zlib.decompress(res[0])
+
+
+def offload_tool_messages(
+    messages: list[AnyMessage],
+    payload_store: BasePayloadStore,
+    max_inline_bytes: int = MAX_INLINE_PAYLOAD_BYTES,
+) -> list[AnyMessage]:
+    """Move large tool outputs to the payload store, keeping a preview and a reference in the message."""
+    offloaded_messages = []
+    for message in messages:
+        if (
+            not isinstance(message, ToolMessage)
+            or not isinstance(message.content, str)
+            or PAYLOAD_REF_KEY in message.additional_kwargs
+        ):
+            offloaded_messages.append(message)
+            continue
+
+        payload = message.content.encode()
+        if len(payload) <= max_inline_bytes:
+            offloaded_messages.append(message)
+            continue
+
+        key = payload_store.put(payload)
+        preview = message.content[:PAYLOAD_PREVIEW_CHARS]
+        offloaded_message = message.copy(
+            update={
+                "content": f"{preview}... [truncated, full output stored as '{key}']",
+                "additional_kwargs": {
+                    **message.additional_kwargs,
+                    PAYLOAD_REF_KEY: key,
+                },
+            }
+        )
+        offloaded_messages.append(offloaded_message)
+    return offloaded_messages
+
+
+def resolve_tool_message(
+    message: AnyMessage, payload_store: BasePayloadStore
+) -> AnyMessage:
+    """Restore the full tool output for a message that was offloaded to the payload store."""
+    key = message.additional_kwargs.get(PAYLOAD_REF_KEY)
+    if key is None:
+        return message
+
+    payload = payload_store.get(key)
+    if payload is None:
+        return message
+
+    additional_kwargs = {
+        name: value
+        for name, value in message.additional_kwargs.items()
+        if name != PAYLOAD_REF_KEY
+    }
+    return message.copy(
+        update={"content": payload.decode(), "additional_kwargs": additional_kwargs}
+    )
+
+
+class CompressedSerializer(SerializerProtocol):
+    """Checkpoint serializer that compresses large checkpoints.
+
+    Everything else (e.g. checkpoint metadata) is kept as is, so that checkpointers
+    can still filter on it.
+    """
+
+    def __init__(
+        self,
+        serde: Optional[SerializerProtocol] = None,
+        min_bytes: int = MAX_INLINE_PAYLOAD_BYTES,
+        level: int = 6,
+    ) -> None:
+        self.serde = serde or JsonPlusSerializer()
+        self.min_bytes = min_bytes
+        self.level = level
+
+    def dumps(self, obj: Any) -> bytes:
+        data = self.serde.dumps(obj)
+        # NOTE: checkpointers use the same serializer for the metadata, which can be
+        # just as large (it includes the node writes), so this can't go by size alone
+        is_checkpoint = isinstance(obj, dict) and "channel_values" in obj
+        if not is_checkpoint or len(data) < self.min_bytes:
+            return data
+
+        return COMPRESSED_PREFIX + zlib.compress(data, self.level)
+
+    def loads(self, data: bytes) -> Any:
+        if data.startswith(COMPRESSED_PREFIX):
+            data = zlib.decompress(data[len(COMPRESSED_PREFIX) :])
+
+        return self.serde.loads(data)
@@ -2,3 +2,6 @@ import os
 
 # somewhat hacky way to determine if the app is being run from inside LangGraph API
 IS_LANGGRAPH_API = os.environ.get("POSTGRES_URI")
+
+# where large tool outputs are stored when running inside LangGraph API
+PAYLOAD_STORE_PATH = os.environ.get("PAYLOAD_STORE_PATH", ".langgraph-data/payloads.db")
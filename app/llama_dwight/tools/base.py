@@ -75,3 +75,22 @@ class BaseDataToolKit(abc.ABC):
     def clear(self) -> None:
         """Clear any intermediate toolkit state."""
         raise NotImplementedError
+
+    def refresh(self) -> int:
+        """Load rows appended to the data source since the last load. Returns the number of new rows.
+
+        Takes effect for intermediate toolkit state on the next `clear()`.
+        """
+        raise NotImplementedError
+
+    def new_session(self, record_workload: bool = True) -> "BaseDataToolKit":
+        """Create a toolkit with its own intermediate state on top of the same (read-only) data.
+
+        If `record_workload` is False, the session's queries aren't recorded in any
+        workload statistics shared with other sessions (e.g. for index recommendations).
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release any resources held by the toolkit."""
+        raise NotImplementedError
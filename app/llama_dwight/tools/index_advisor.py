@@ -0,0 +1,402 @@
+import collections
+import dataclasses
+import logging
+import threading
+from typing import Optional
+
+from sqlalchemy import Connection, Engine, text as sql_text
+
+from llama_dwight.tools.types import FilterOperator, FilterSpec
+
+logger = logging.getLogger(__name__)
+
+INDEX_PREFIX = "llama_dwight_ix"
+# rough per-entry overhead of an index b-tree entry (rowid, cell header, page slack)
+INDEX_ENTRY_OVERHEAD_BYTES = 16
+# same ballpark as SQLite query planner's estimate for a range constraint
+RANGE_SELECTIVITY = 0.25
+# filters that select a larger fraction of rows than this are cheaper as full scans
+MAX_FILTER_SELECTIVITY = 0.1
+
+RANGE_OPERATORS = frozenset(
+    {
+        FilterOperator.GREATER,
+        FilterOperator.GREATER_OR_EQ,
+        FilterOperator.LESS,
+        FilterOperator.LESS_OR_EQ,
+    }
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class IndexAdvisorConfig:
+    # create recommended indexes in the background. Otherwise, only recommend them.
+    # Requires the DB to be in WAL mode, so that index creation doesn't block readers
+    auto_create: bool = False
+    # max total estimated size of the indexes created by the advisor
+    storage_budget_bytes: int = 512 * 1024 * 1024
+    # min number of times a query shape needs to be seen to be considered for an index
+    min_frequency: int = 3
+    # max number of columns in a composite (covering) index
+    max_index_columns: int = 4
+
+
+DEFAULT_INDEX_ADVISOR_CONFIG = IndexAdvisorConfig()
+
+
+@dataclasses.dataclass
+class QueryShape:
+    """Table columns used by a single analysis, grouped by how they're accessed."""
+
+    eq_columns: set[str] = dataclasses.field(default_factory=set)
+    range_columns: set[str] = dataclasses.field(default_factory=set)
+    # groupby / sort columns, in the order they were used
+    order_columns: list[str] = dataclasses.field(default_factory=list)
+    value_columns: set[str] = dataclasses.field(default_factory=set)
+
+    def add_filters(self, filters: list[FilterSpec]) -> None:
+        for filter_spec in filters:
+            if filter_spec.operator == FilterOperator.EQ:
+                self.eq_columns.add(filter_spec.column)
+            elif filter_spec.operator in RANGE_OPERATORS:
+                self.range_columns.add(filter_spec.column)
+
+    def freeze(self) -> tuple[tuple[str, ...], ...]:
+        return (
+            tuple(sorted(self.eq_columns)),
+            tuple(sorted(self.range_columns)),
+            tuple(dict.fromkeys(self.order_columns)),
+            tuple(sorted(self.value_columns)),
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class ColumnStats:
+    n_distinct: int
+    avg_bytes: float
+
+
+@dataclasses.dataclass(frozen=True)
+class IndexRecommendation:
+    table_name: str
+    columns: tuple[str, ...]
+    # number of recorded analyses that would use this index
+    frequency: int
+    # estimated fraction of table rows selected by the filters this index serves
+    selectivity: float
+    estimated_bytes: int
+
+    @property
+    def name(self) -> str:
+        return "_".join([INDEX_PREFIX, self.table_name, *self.columns])
+
+    @property
+    def benefit(self) -> float:
+        return self.frequency * (1 - self.selectivity)
+
+    def get_create_query(self) -> str:
+        columns = ", ".join(f'"{column}"' for column in self.columns)
+        return f'CREATE INDEX IF NOT EXISTS "{self.name}" ON "{self.table_name}" ({columns})'
+
+
+class IndexAdvisor:
+    """Record the workload on a table and recommend (or create) indexes for it."""
+
+    def __init__(
+        self,
+        engine: Engine,
+        table_name: str,
+        config: IndexAdvisorConfig = DEFAULT_INDEX_ADVISOR_CONFIG,
+    ) -> None:
+        self.engine = engine
+        self.table_name = table_name
+        self.config = config
+        self.shape_counts: collections.Counter = collections.Counter()
+        self.column_stats: dict[str, ColumnStats] = {}
+        self.row_count: Optional[int] = None
+        # rowid high-water mark at the time the stats were collected
+        self.stats_max_rowid = 0
+        self._n_recorded = 0
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        if config.auto_create:
+            self._check_journal_mode()
+
+    def _check_journal_mode(self) -> None:
+        with self.engine.connect() as conn:
+            journal_mode = conn.execute(sql_text("PRAGMA journal_mode")).scalar()
+
+        # in rollback journal modes, CREATE INDEX locks out readers while it commits
+        if str(journal_mode).lower() != "wal":
+            raise ValueError(
+                f"Creating indexes automatically requires WAL journal mode, got '{journal_mode}'"
+            )
+
+    def record(self, shape: QueryShape) -> None:
+        """Record a completed analysis. Might kick off index creation in the background."""
+        key = shape.freeze()
+        eq_columns, range_columns, order_columns, _ = key
+        if not (eq_columns or range_columns or order_columns):
+            # full scans that no index can help with
+            return
+
+        with self._lock:
+            self.shape_counts[key] += 1
+            self._n_recorded += 1
+            should_create = (
+                self.config.auto_create
+                and self._n_recorded % self.config.min_frequency == 0
+                and (self._worker is None or not self._worker.is_alive())
+            )
+            if should_create:
+                self._worker = threading.Thread(
+                    target=self._create_indexes, daemon=True
+                )
+                self._worker.start()
+
+    def _update_stats(self, conn: Connection, columns: set[str]) -> None:
+        with self._lock:
+            missing_columns = sorted(columns - self.column_stats.keys())
+            if not missing_columns and self.row_count is not None:
+                return
+
+        # collect stats for all columns in a single scan. The scan can be slow on
+        # large tables, so it runs without the lock to not block recording queries
+        res = conn.execute(sql_text(self._get_stats_query(missing_columns))).fetchone()
+        with self._lock:
+            self.row_count = res[0]
+            self.stats_max_rowid = res[1] or 0
+            for i, column in enumerate(missing_columns):
+                n_distinct, avg_bytes = res[2 + 2 * i], res[3 + 2 * i]
+                self.column_stats[column] = ColumnStats(n_distinct, avg_bytes or 0.0)
+
+    def _get_stats_query(self, columns: list[str], min_rowid: int = 0) -> str:
+        aggregations = ["COUNT(*)", "MAX(rowid)"]
+        for column in columns:
+            aggregations.append(f'COUNT(DISTINCT "{column}")')
+            aggregations.append(f'AVG(LENGTH("{column}"))')
+
+        return f'SELECT {", ".join(aggregations)} FROM "{self.table_name}" WHERE rowid > {min_rowid}'
+
+    def refresh_stats(self, conn: Connection) -> None:
+        """Update cached table statistics with the rows appended since they were collected."""
+        with self._lock:
+            if self.row_count is None:
+                return
+
+            columns = sorted(self.column_stats)
+            stats_max_rowid = self.stats_max_rowid
+
+        res = conn.execute(
+            sql_text(self._get_stats_query(columns, stats_max_rowid))
+        ).fetchone()
+        n_new_rows = res[0]
+        if n_new_rows == 0:
+            return
+
+        with self._lock:
+            # stats were already refreshed by a concurrent call
+            if self.stats_max_rowid != stats_max_rowid:
+                return
+
+            n_rows = self.row_count + n_new_rows
+            for i, column in enumerate(columns):
+                stats = self.column_stats[column]
+                n_distinct, avg_bytes = res[2 + 2 * i], res[3 + 2 * i]
+                self.column_stats[column] = ColumnStats(
+                    # appended values can overlap with the existing ones,
+                    # so this is a lower bound on the number of distinct values
+                    n_distinct=max(stats.n_distinct, n_distinct),
+                    avg_bytes=(
+                        stats.avg_bytes * self.row_count
+                        + (avg_bytes or 0.0) * n_new_rows
+                    )
+                    / n_rows,
+                )
+
+            self.row_count = n_rows
+            self.stats_max_rowid = res[1]
+
+    def _get_selectivity(self, column: str) -> float:
+        return 1 / max(self.column_stats[column].n_distinct, 1)
+
+    def _get_existing_indexes(self, conn: Connection) -> dict[str, tuple[str, ...]]:
+        """Get the columns of the indexes on the table, keyed by index name."""
+        indexes = {}
+        index_list = conn.execute(
+            sql_text(f'PRAGMA index_list("{self.table_name}")')
+        ).fetchall()
+        for index in index_list:
+            index_info = conn.execute(
+                sql_text(f'PRAGMA index_info("{index.name}")')
+            ).fetchall()
+            indexes[index.name] = tuple(column.name for column in index_info)
+        return indexes
+
+    def _estimate_index_bytes(self, columns: tuple[str, ...]) -> int:
+        return int(
+            self.row_count
+            * (
+                sum(self.column_stats[column].avg_bytes for column in columns)
+                + INDEX_ENTRY_OVERHEAD_BYTES
+            )
+        )
+
+    def _get_candidate(
+        self, key: tuple[tuple[str, ...], ...], frequency: int
+    ) -> Optional[IndexRecommendation]:
+        eq_columns, range_columns, order_columns, value_columns = key
+        # most selective equality columns go first, so that the index prefix is useful on its own
+        columns = sorted(eq_columns, key=self._get_selectivity)
+        selectivity = 1.0
+        for column in eq_columns:
+            selectivity *= self._get_selectivity(column)
+
+        if order_columns:
+            # index is scanned in the groupby / sort order
+            columns.extend(column for column in order_columns if column not in columns)
+        elif range_columns:
+            # only a single range constraint can be used by the index
+            range_column = min(range_columns, key=self._get_selectivity)
+            columns.append(range_column)
+            selectivity *= RANGE_SELECTIVITY
+
+        if selectivity > MAX_FILTER_SELECTIVITY and not order_columns:
+            return None
+
+        # make the index covering, if it fits
+        covering_columns = [
+            column
+            for column in (*range_columns, *value_columns)
+            if column not in columns
+        ]
+        if len(columns) + len(covering_columns) <= self.config.max_index_columns:
+            columns.extend(covering_columns)
+
+        columns = tuple(columns[: self.config.max_index_columns])
+        return IndexRecommendation(
+            table_name=self.table_name,
+            columns=columns,
+            frequency=frequency,
+            selectivity=selectivity,
+            estimated_bytes=self._estimate_index_bytes(columns),
+        )
+
+    def recommend(self) -> list[IndexRecommendation]:
+        """Recommend indexes for the recorded workload, most beneficial first."""
+        with self._lock:
+            shape_counts = {
+                key: frequency
+                for key, frequency in self.shape_counts.items()
+                if frequency >= self.config.min_frequency
+            }
+
+        with self.engine.connect() as conn:
+            table_info = conn.execute(
+                sql_text(f'PRAGMA table_info("{self.table_name}")')
+            ).fetchall()
+            table_columns = {column.name for column in table_info}
+            # ignore shapes that reference columns derived by earlier steps
+            shape_counts = {
+                key: frequency
+                for key, frequency in shape_counts.items()
+                if all(set(columns) <= table_columns for columns in key)
+            }
+            used_columns = {
+                column for key in shape_counts for columns in key for column in columns
+            }
+            self._update_stats(conn, used_columns)
+
+            existing_indexes = list(self._get_existing_indexes(conn).values())
+
+        candidates: dict[tuple[str, ...], IndexRecommendation] = {}
+        for key, frequency in shape_counts.items():
+            candidate = self._get_candidate(key, frequency)
+            if candidate is None:
+                continue
+
+            if candidate.columns in candidates:
+                candidate = dataclasses.replace(
+                    candidate,
+                    frequency=candidates[candidate.columns].frequency + frequency,
+                )
+            candidates[candidate.columns] = candidate
+
+        # drop candidates that are served by the prefix of another index
+        index_columns = [*existing_indexes, *candidates]
+        recommendations = [
+            candidate
+            for columns, candidate in candidates.items()
+            if not any(
+                other != columns and other[: len(columns)] == columns
+                for other in index_columns
+            )
+            and columns not in existing_indexes
+        ]
+        return sorted(
+            recommendations,
+            key=lambda recommendation: recommendation.benefit,
+            reverse=True,
+        )
+
+    def create_indexes(self) -> list[IndexRecommendation]:
+        """Create recommended indexes that fit into the storage budget."""
+        created = []
+        recommendations = self.recommend()
+        if not recommendations:
+            return created
+
+        with self.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as conn:
+            # indexes created earlier (e.g. before a restart, or by another process)
+            # count towards the budget too
+            advisor_indexes = [
+                columns
+                for name, columns in self._get_existing_indexes(conn).items()
+                if name.startswith(INDEX_PREFIX)
+            ]
+            self._update_stats(
+                conn, {column for columns in advisor_indexes for column in columns}
+            )
+            used_bytes = sum(map(self._estimate_index_bytes, advisor_indexes))
+            for recommendation in recommendations:
+                estimated_bytes = used_bytes + recommendation.estimated_bytes
+                if estimated_bytes > self.config.storage_budget_bytes:
+                    continue
+
+                conn.execute(sql_text(recommendation.get_create_query()))
+                used_bytes = estimated_bytes
+                created.append(recommendation)
+
+            if created:
+                conn.execute(sql_text(f'ANALYZE "{self.table_name}"'))
+        return created
+
+    def _create_indexes(self) -> None:
+        try:
+            created = self.create_indexes()
+        except Exception:
+            logger.exception("Failed to create indexes for '%s'", self.table_name)
+            return
+
+        for recommendation in created:
+            logger.info("Created index '%s'", recommendation.name)
+
+
+_INDEX_ADVISORS: dict[tuple[Engine, str, IndexAdvisorConfig], IndexAdvisor] = {}
+_INDEX_ADVISORS_LOCK = threading.Lock()
+
+
+def get_index_advisor(
+    engine: Engine,
+    table_name: str,
+    config: IndexAdvisorConfig = DEFAULT_INDEX_ADVISOR_CONFIG,
+) -> IndexAdvisor:
+    """Get an index advisor for the table that is shared across toolkits."""
+    key = (engine, table_name, config)
+    with _INDEX_ADVISORS_LOCK:
+        if key not in _INDEX_ADVISORS:
+            _INDEX_ADVISORS[key] = IndexAdvisor(engine, table_name, config)
+
+        return _INDEX_ADVISORS[key]
@@ -1,4 +1,8 @@
-from typing import Any, Union, Optional
+import dataclasses
+import io
+import os
+import threading
+from typing import Any, BinaryIO, Union, Optional
 
 import pandas as pd
 
@@ -29,12 +33,66 @@ def preprocess_df(df: pd.DataFrame) -> pd.DataFrame:
                 continue
 
 
+@dataclasses.dataclass(frozen=True)
+class FileCursor:
+    """Position in a CSV file up to which the rows have been loaded."""
+
+    offset: int
+    mtime: float
+    # used to detect files that were rewritten rather than appended to
+    header: bytes
+
+
+def get_complete_length(f: BinaryIO, data: bytes, stat: os.stat_result) -> int:
+    """Get the length of the data read from the file, without the last line if it's still being written.
+
+    The last line is only held back if the file changed since `stat`, so that files
+    that don't end with a line break don't lose their last row.
+    """
+    current_stat = os.fstat(f.fileno())
+    if current_stat.st_size == stat.st_size and current_stat.st_mtime == stat.st_mtime:
+        return len(data)
+
+    return data.rfind(b"\n") + 1
+
+
+def read_csv_with_cursor(filepath: str) -> tuple[pd.DataFrame, FileCursor]:
+    """Read CSV file and return a cursor that can be used to read the rows appended later."""
+    stat = os.stat(filepath)
+    with open(filepath, "rb") as f:
+        header = f.readline()
+        f.seek(0)
+        # only read up to the size at the time of the stat, in case the file is being appended to
+        data = f.read(stat.st_size)
+        # the partial last line is picked up on refresh.
+        # A file without any line breaks only has the header
+        end = get_complete_length(f, data, stat) or len(data)
+
+    df = pd.read_csv(io.BytesIO(data[:end]))
+    return df, FileCursor(offset=end, mtime=stat.st_mtime, header=header)
+
+
 class PandasDataToolKit(BaseDataToolKit):
-    def __init__(self, df: pd.DataFrame) -> None:
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        filepath: Optional[str] = None,
+        preprocess: bool = False,
+        cursor: Optional[FileCursor] = None,
+        parent: Optional["PandasDataToolKit"] = None,
+    ) -> None:
         self.df = df
         # this will be used for any intermediate outputs of the latest tool call
         # such as filter, sort etc.
-        self.current_df = df.copy()
+        # NOTE: tools never modify dataframes in place, so this doesn't need a copy
+        self.current_df = df
+        # used for refreshing the data when the file is appended to
+        self.filepath = filepath
+        self.preprocess = preprocess
+        self.cursor = cursor
+        # toolkit that owns the data, for session toolkits
+        self.parent = parent
+        self._refresh_lock = threading.Lock()
 
     @classmethod
     def from_filepath(
@@ -44,10 +102,60 @@ class PandasDataToolKit(BaseDataToolKit):
         if not filepath.endswith(".csv"):
             raise ValueError("Only accepting CSV files.")
 
-        df = pd.read_csv(filepath)
+        df, cursor = read_csv_with_cursor(filepath)
         if preprocess:
             preprocess_df(df)
-        return cls(df)
+        return cls(df, filepath=filepath, preprocess=preprocess, cursor=cursor)
+
+    def refresh(self) -> int:
+        """Load rows appended to the CSV file since the last load."""
+        if self.parent is not None:
+            n_new_rows = self.parent.refresh()
+            self.df = self.parent.df
+            return n_new_rows
+
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh(self) -> int:
+        if self.filepath is None or self.cursor is None:
+            return 0
+
+        stat = os.stat(self.filepath)
+        if stat.st_size == self.cursor.offset and stat.st_mtime == self.cursor.mtime:
+            return 0
+
+        with open(self.filepath, "rb") as f:
+            header = f.readline()
+            if header != self.cursor.header or stat.st_size < self.cursor.offset:
+                # the file was rewritten, need to do a full reload
+                df, cursor = read_csv_with_cursor(self.filepath)
+                if self.preprocess:
+                    preprocess_df(df)
+
+                self.df = df
+                self.cursor = cursor
+                return len(df)
+
+            f.seek(self.cursor.offset)
+            data = f.read(stat.st_size - self.cursor.offset)
+            # skip the last line if it's still being written
+            end = get_complete_length(f, data, stat)
+
+        self.cursor = dataclasses.replace(
+            self.cursor, offset=self.cursor.offset + end, mtime=stat.st_mtime
+        )
+        if not data[:end].strip():
+            return 0
+
+        new_df = pd.read_csv(io.BytesIO(data[:end]), header=None, names=self.df.columns)
+        if self.preprocess:
+            preprocess_df(new_df)
+
+        # NOTE: self.df is replaced rather than modified in place, so that
+        # the intermediate state (current_df) stays consistent until cleared
+        self.df = pd.concat([self.df, new_df], ignore_index=True)
+        return len(new_df)
 
     def get_schema(self) -> dict:
         return self.df.dtypes.astype("str").str.replace("object", "str").to_dict()
@@ -72,7 +180,7 @@ class PandasDataToolKit(BaseDataToolKit):
         groupby_columns: list[str],
         value_column: str,
         aggregation_func: AggregationFunc,
-        freq: Optional[str],
+        freq: Optional[str] = None,
     ) -> dict[tuple[str, ...], Any]:
         if not isinstance(groupby_columns, list):
             raise TypeError(
@@ -141,4 +249,13 @@ class PandasDataToolKit(BaseDataToolKit):
             return "Successfully sorted data."
 
     def clear(self) -> None:
-        self.current_df = self.df.copy()
+        self.current_df = self.df
+
+    def new_session(self, record_workload: bool = True) -> "PandasDataToolKit":
+        parent = self if self.parent is None else self.parent
+        # NOTE: start from this toolkit's snapshot of the data, which can lag behind the parent
+        return PandasDataToolKit(self.df, parent=parent)
+
+    def close(self) -> None:
+        # nothing to release, the data is owned by the parent toolkit
+        pass
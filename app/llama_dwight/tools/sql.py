@@ -1,13 +1,114 @@
+import dataclasses
+import threading
 from typing import Any, Union, Optional
 
-from sqlalchemy import Engine, create_engine, text as sql_text
+from sqlalchemy import (
+    Connection,
+    Engine,
+    create_engine,
+    event,
+    make_url,
+    text as sql_text,
+)
 
 from llama_dwight.tools.types import FilterSpec, FilterOperator, FilterValueType
 from llama_dwight.tools.base import BaseDataToolKit
+from llama_dwight.tools.index_advisor import (
+    DEFAULT_INDEX_ADVISOR_CONFIG,
+    IndexAdvisor,
+    IndexAdvisorConfig,
+    QueryShape,
+    get_index_advisor,
+)
 from llama_dwight.tools.types import AggregationFunc, validate_aggregation_func
 
 
 VIEW_PREFIX = "result"
+# number of rows fetched from the DB cursor at a time
+FETCH_BATCH_SIZE = 1024
+
+
+@dataclasses.dataclass(frozen=True)
+class SQLiteConfig:
+    """Connection settings for SQLite DBs. `None` leaves the SQLite default in place."""
+
+    # e.g. "WAL" -- ignored for read-only DBs, since it requires write access
+    journal_mode: Optional[str] = None
+    # max number of bytes of the DB file that can be memory-mapped
+    mmap_size: Optional[int] = 256 * 1024 * 1024
+    # page cache size: positive values are pages, negative values are KiB
+    cache_size: Optional[int] = -64 * 1024
+    # where temporary tables / indices are stored: "DEFAULT", "FILE" or "MEMORY"
+    temp_store: Optional[str] = "MEMORY"
+    # open the DB in read-only mode. Use for analysis-only DBs
+    read_only: bool = False
+    # additionally assume the DB file cannot be changed by anyone while it's open
+    # (implies read-only). Use only for DB files that are never written to
+    immutable: bool = False
+    # number of connections kept open in the pool. Each toolkit session holds one,
+    # and more connections are opened as needed
+    pool_size: int = 16
+
+    def get_pragmas(self) -> dict[str, Any]:
+        pragmas = {
+            "mmap_size": self.mmap_size,
+            "cache_size": self.cache_size,
+            "temp_store": self.temp_store,
+        }
+        if not self.read_only and not self.immutable:
+            pragmas["journal_mode"] = self.journal_mode
+
+        return {name: value for name, value in pragmas.items() if value is not None}
+
+
+DEFAULT_SQLITE_CONFIG = SQLiteConfig()
+
+# engines (and their connection pools) are shared across all toolkits in the process
+_ENGINES: dict[tuple[str, SQLiteConfig], Engine] = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def _create_sqlite_engine(conn_string: str, sqlite_config: SQLiteConfig) -> Engine:
+    url = make_url(conn_string)
+    if sqlite_config.read_only or sqlite_config.immutable:
+        if not url.database:
+            raise ValueError("Cannot open in-memory SQLite DB in read-only mode.")
+
+        query = {**url.query, "mode": "ro", "uri": "true"}
+        if sqlite_config.immutable:
+            query["immutable"] = "1"
+        url = url.set(database=f"file:{url.database}", query=query)
+
+    if url.database and url.database != ":memory:":
+        engine = create_engine(url, pool_size=sqlite_config.pool_size, max_overflow=-1)
+    else:
+        # in-memory DBs use a single connection per thread
+        engine = create_engine(url)
+    pragmas = sqlite_config.get_pragmas()
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    return engine
+
+
+def get_engine(
+    conn_string: str, sqlite_config: SQLiteConfig = DEFAULT_SQLITE_CONFIG
+) -> Engine:
+    """Get a shared engine for the connection string, creating it if needed."""
+    if "sqlite" not in conn_string:
+        raise ValueError("Only SQLite DB is supported at the moment.")
+
+    key = (conn_string, sqlite_config)
+    with _ENGINES_LOCK:
+        if key not in _ENGINES:
+            _ENGINES[key] = _create_sqlite_engine(conn_string, sqlite_config)
+
+        return _ENGINES[key]
 
 
 def get_sql_aggregation_operator(aggregation_func: AggregationFunc) -> None:
@@ -34,21 +135,99 @@ def convert_filter_value(value: str, value_type: FilterValueType) -> Union[str,
         raise ValueError(f"Unsupported value type '{value_type}'")
 
 
+def estimate_value_bytes(value: Any) -> int:
+    if isinstance(value, (str, bytes)):
+        return len(value)
+
+    return 8
+
+
+def fetch_columns(
+    conn: Connection,
+    query: str,
+    limit: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    batch_size: int = FETCH_BATCH_SIZE,
+) -> tuple[dict[str, list], bool]:
+    """Fetch query results in batches, as a mapping of column name -> column values.
+
+    Stops early once `limit` rows or approximately `max_bytes` worth of values are fetched.
+    Also returns whether the results were truncated because of that.
+    """
+    if limit is not None:
+        # fetch an extra row to tell if there are more results than the limit
+        query = f"SELECT * FROM ({query}) LIMIT {limit + 1}"
+
+    result = conn.execute(sql_text(query))
+    columns = {column: [] for column in result.keys()}
+    n_rows = 0
+    n_bytes = 0
+    is_truncated = False
+    try:
+        while not is_truncated and (rows := result.fetchmany(batch_size)):
+            if limit is not None and n_rows + len(rows) > limit:
+                rows = rows[: limit - n_rows]
+                is_truncated = True
+
+            if max_bytes is not None:
+                for i, row in enumerate(rows):
+                    n_bytes += sum(map(estimate_value_bytes, row))
+                    if n_bytes > max_bytes:
+                        rows = rows[:i]
+                        is_truncated = True
+                        break
+
+            n_rows += len(rows)
+            # transpose the batch instead of building an object per row
+            for values, batch_values in zip(columns.values(), zip(*rows)):
+                values.extend(batch_values)
+    finally:
+        result.close()
+
+    return columns, is_truncated
+
+
 class SQLDataToolKit(BaseDataToolKit):
-    def __init__(self, engine: Engine, table_name: str) -> None:
+    def __init__(
+        self,
+        engine: Engine,
+        table_name: str,
+        index_advisor: Optional[IndexAdvisor] = None,
+        max_result_rows: Optional[int] = None,
+        max_result_bytes: Optional[int] = None,
+        max_rowid: Optional[int] = None,
+    ) -> None:
         self.engine = engine
         self.table_name = table_name
+        # limits on the size of the results returned by the tools
+        self.max_result_rows = max_result_rows
+        self.max_result_bytes = max_result_bytes
+        # columns used by the current analysis, recorded by the index advisor.
+        # this is only tracked until the first aggregation, after which the columns
+        # no longer refer to the original table
+        self.query_shape: Optional[QueryShape] = QueryShape()
+        # persistent connection for the lifetime of the toolkit.
+        # intermediate results are stored as temp views that are only visible
+        # to this connection, which also works for read-only DBs
+        self.conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        # rows appended after this rowid high-water mark are only picked up on refresh,
+        # so that the intermediate state stays consistent.
+        # Sources without a usable rowid (e.g. views) aren't pinned and can't be refreshed
+        has_rowid = self.has_rowid()
+        if max_rowid is None and has_rowid:
+            max_rowid = self.get_max_rowid()
+        self.max_rowid = max_rowid
+        # the index advisor collects table stats incrementally by rowid
+        self.index_advisor = index_advisor if has_rowid else None
         self.views = []
-        self.create_view(f"SELECT * FROM {self.table_name}")
+        self.create_view(self.get_base_query())
 
     def create_view(self, query: str) -> None:
         view_name = f"{VIEW_PREFIX}_{len(self.views)}"
-        drop_query = sql_text(f"DROP VIEW IF EXISTS {view_name}")
-        create_query = sql_text(f"CREATE VIEW {view_name} AS {query}")
-        with self.engine.connect() as conn:
-            conn.execute(drop_query)
-            conn.execute(create_query)
-
+        drop_query = sql_text(f"DROP VIEW IF EXISTS temp.{view_name}")
+        create_query = sql_text(f"CREATE TEMP VIEW {view_name} AS {query}")
+        self.conn.execute(drop_query)
+        self.conn.execute(create_query)
         self.views.append(view_name)
 
     @property
@@ -59,19 +238,103 @@ class SQLDataToolKit(BaseDataToolKit):
         return self.views[-1]
 
     @classmethod
-    def from_conn_string(cls, conn_string: str, table_name: str) -> "SQLDataToolKit":
+    def from_conn_string(
+        cls,
+        conn_string: str,
+        table_name: str,
+        sqlite_config: SQLiteConfig = DEFAULT_SQLITE_CONFIG,
+        index_advisor_config: IndexAdvisorConfig = DEFAULT_INDEX_ADVISOR_CONFIG,
+        max_result_rows: Optional[int] = None,
+        max_result_bytes: Optional[int] = None,
+    ) -> "SQLDataToolKit":
         """Load DB from connection and table."""
-        if "sqlite" not in conn_string:
-            raise ValueError("Only SQLite DB is supported at the moment.")
+        engine = get_engine(conn_string, sqlite_config)
+        index_advisor = get_index_advisor(engine, table_name, index_advisor_config)
+        return cls(
+            engine,
+            table_name,
+            index_advisor=index_advisor,
+            max_result_rows=max_result_rows,
+            max_result_bytes=max_result_bytes,
+        )
+
+    def has_rowid(self) -> bool:
+        """Check if the table has a rowid that can be used to pin a snapshot of its rows."""
+        table_type = self.conn.execute(
+            sql_text("SELECT type FROM sqlite_master WHERE name = :name"),
+            {"name": self.table_name},
+        ).scalar()
+        if table_type != "table":
+            return False
+
+        # NOTE: table_list is only available since SQLite 3.37, older versions return no rows
+        table_info = self.conn.execute(
+            sql_text(f'PRAGMA table_list("{self.table_name}")')
+        ).fetchone()
+        return table_info is None or not table_info.wr
+
+    def get_max_rowid(self) -> int:
+        res = self.conn.execute(
+            sql_text(f"SELECT MAX(rowid) FROM {self.table_name}")
+        ).fetchone()
+        return res[0] or 0
+
+    def get_base_query(self) -> str:
+        if self.max_rowid is None:
+            return f"SELECT * FROM {self.table_name}"
+
+        return f"SELECT * FROM {self.table_name} WHERE rowid <= {self.max_rowid}"
+
+    def refresh(self) -> int:
+        """Pick up rows appended to the table since the last load."""
+        if self.max_rowid is None:
+            # the base view always shows the current rows
+            return 0
+
+        max_rowid = self.get_max_rowid()
+        if max_rowid <= self.max_rowid:
+            return 0
+
+        n_new_rows = self.conn.execute(
+            sql_text(
+                f"SELECT COUNT(*) FROM {self.table_name} WHERE rowid > {self.max_rowid}"
+            )
+        ).fetchone()[0]
+        self.max_rowid = max_rowid
+        if self.index_advisor is not None:
+            self.index_advisor.refresh_stats(self.conn)
+        return n_new_rows
+
+    def fetch_current_view(self) -> dict[str, Any]:
+        """Fetch the current view, as a mapping of column name -> column values.
+
+        If the result doesn't fit the result limits, the partial columns are returned
+        under "result", along with the number of rows returned.
+        """
+        columns, is_truncated = fetch_columns(
+            self.conn,
+            f"SELECT * FROM {self.current_view_name}",
+            limit=self.max_result_rows,
+            max_bytes=self.max_result_bytes,
+        )
+        if not is_truncated:
+            return columns
 
-        engine = create_engine(conn_string)
-        return cls(engine, table_name)
+        # make it explicit that the result is partial, so that it's not mistaken for the full answer
+        n_rows = len(next(iter(columns.values()), []))
+        return {"result": columns, "truncated": True, "n_rows": n_rows}
+
+    def record_query_shape(self) -> None:
+        """Record the columns used by the current analysis in the index advisor."""
+        if self.index_advisor is not None and self.query_shape is not None:
+            self.index_advisor.record(self.query_shape)
+
+        self.query_shape = None
 
     def get_schema(self) -> dict:
-        with self.engine.connect() as conn:
-            cur = conn.execute(sql_text(f"PRAGMA table_info({self.table_name});"))
-            columns = cur.keys()
-            res = cur.fetchall()
+        cur = self.conn.execute(sql_text(f"PRAGMA table_info({self.table_name});"))
+        columns = cur.keys()
+        res = cur.fetchall()
 
         schema_info = [dict(zip(columns, r)) for r in res]
         return {field_info["name"]: field_info["type"] for field_info in schema_info}
@@ -90,20 +353,23 @@ class SQLDataToolKit(BaseDataToolKit):
         aggregations = [f"{aggregation_operator}({col}) AS {col}" for col in columns]
         aggregation = ", ".join(aggregations)
         self.create_view(f"SELECT {aggregation} FROM {self.current_view_name}")
-        with self.engine.connect() as conn:
-            # NOTE: at this point current view is the latest
-            res = conn.execute(
-                sql_text(f"SELECT * FROM {self.current_view_name}")
-            ).fetchall()
-        return dict(zip(columns, res[0]))
+        if self.query_shape is not None:
+            self.query_shape.value_columns.update(columns)
+            self.record_query_shape()
+
+        # NOTE: at this point current view is the latest
+        res = self.conn.execute(
+            sql_text(f"SELECT * FROM {self.current_view_name}")
+        ).fetchone()
+        return dict(zip(columns, res))
 
     def groupby(
         self,
         groupby_columns: list[str],
         value_column: str,
         aggregation_func: AggregationFunc,
-        freq: Optional[str],
-    ) -> dict[tuple[str, ...], Any]:
+        freq: Optional[str] = None,
+    ) -> dict[str, Any]:
         if not isinstance(groupby_columns, list):
             raise TypeError(
                 f"Expected groupby_columns to be a list, got '{groupby_columns}' instead"
@@ -119,12 +385,13 @@ class SQLDataToolKit(BaseDataToolKit):
         self.create_view(
             f"SELECT {aggregation}, {groupby} FROM {self.current_view_name} GROUP BY {groupby}"
         )
-        with self.engine.connect() as conn:
-            # NOTE: at this point current view is the latest
-            cur = conn.execute(sql_text(f"SELECT * FROM {self.current_view_name}"))
-            columns = cur.keys()
-            res = cur.fetchall()
-        return [dict(zip(columns, r)) for r in res]
+        if self.query_shape is not None:
+            self.query_shape.order_columns.extend(groupby_columns)
+            self.query_shape.value_columns.add(value_column)
+            self.record_query_shape()
+
+        # NOTE: at this point current view is the latest
+        return self.fetch_current_view()
 
     def filter(self, filters: list[FilterSpec]) -> None:
         if not filters:
@@ -152,6 +419,8 @@ class SQLDataToolKit(BaseDataToolKit):
 
         where = " AND ".join(wheres)
         self.create_view(f"SELECT * FROM {self.current_view_name} WHERE {where}")
+        if self.query_shape is not None:
+            self.query_shape.add_filters(filters)
         return "Successfully filtered data."
 
     def sort(self, column: str, ascending: bool, limit: int | None) -> None:
@@ -162,22 +431,42 @@ class SQLDataToolKit(BaseDataToolKit):
         if limit is None:
             self.create_view(sort_query)
         else:
-            self.create_view(sort_query + f"LIMIT {limit}")
+            self.create_view(sort_query + f" LIMIT {limit}")
+
+        if self.query_shape is not None:
+            self.query_shape.order_columns.append(column)
 
         if limit:
-            with self.engine.connect() as conn:
-                # NOTE: at this point current view is the latest
-                cur = conn.execute(sql_text(f"SELECT * FROM {self.current_view_name}"))
-                columns = cur.keys()
-                res = cur.fetchall()
-            return [dict(zip(columns, r)) for r in res]
+            self.record_query_shape()
+            # NOTE: at this point current view is the latest
+            return self.fetch_current_view()
         else:
             return "Successfully sorted data."
 
     def clear(self) -> None:
         while self.views:
             view_name = self.views.pop()
-            with self.engine.connect() as conn:
-                conn.execute(sql_text(f"DROP VIEW IF EXISTS {view_name}"))
+            self.conn.execute(sql_text(f"DROP VIEW IF EXISTS temp.{view_name}"))
+
+        self.create_view(self.get_base_query())
+        self.query_shape = QueryShape()
+
+    def new_session(self, record_workload: bool = True) -> "SQLDataToolKit":
+        return SQLDataToolKit(
+            self.engine,
+            self.table_name,
+            index_advisor=self.index_advisor if record_workload else None,
+            max_result_rows=self.max_result_rows,
+            max_result_bytes=self.max_result_bytes,
+            # start from the same snapshot of the table
+            max_rowid=self.max_rowid,
+        )
+
+    def close(self) -> None:
+        """Drop intermediate views and return the connection to the shared pool."""
+        # temp views outlive the checkout, since pooled connections are reused
+        while self.views:
+            view_name = self.views.pop()
+            self.conn.execute(sql_text(f"DROP VIEW IF EXISTS temp.{view_name}"))
 
-        self.create_view(f"SELECT * from {self.table_name}")
+        self.conn.close()
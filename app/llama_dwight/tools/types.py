@@ -1,7 +1,7 @@
 import enum
 from typing import Optional
 
-from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.pydantic_v1 import BaseModel, Field, root_validator
 
 
 @enum.unique
@@ -52,8 +52,8 @@ class GroupbyInput(BaseModel):
     aggregation_func: AggregationFunc = Field(
         description="Aggregation function to apply to the value column, for each group. REMEMBER: Average always refers to 'mean'"
     )
-    freq: GroupbyFreq = Field(
-        description="Frequency for grouping by a date column. Values: 'ME' = monthly, 'QE' = quarterly, 'YE' = yearly"
+    freq: Optional[GroupbyFreq] = Field(
+        description="Optional: frequency for grouping by a date column. Values: 'ME' = monthly, 'QE' = quarterly, 'YE' = yearly"
     )
 
 
@@ -93,3 +93,40 @@ class SortInput(BaseModel):
     limit: Optional[int] = Field(
         description="Optional: limit to the first n results. For descending sort this means n largest values, for ascending - n smallest values"
     )
+
+
+class AnalysisPlan(BaseModel):
+    """Structured version of the analysis plan that can be executed without an agent loop."""
+
+    description: str = Field(
+        description="Step-by-step plan for the junior analyst, in plain English"
+    )
+    filter: Optional[FilterInput] = Field(
+        description="Optional: filter step, applied first"
+    )
+    sort: Optional[SortInput] = Field(
+        description="Optional: sort step, applied after the filter step"
+    )
+    aggregate: Optional[AggregationInput] = Field(
+        description="Optional: aggregation step, applied last. DO NOT use together with groupby"
+    )
+    groupby: Optional[GroupbyInput] = Field(
+        description="Optional: groupby aggregation step, applied last. DO NOT use together with aggregate"
+    )
+
+    @root_validator(skip_on_failure=True)
+    def validate_steps(cls, values: dict) -> dict:
+        if values.get("aggregate") is not None and values.get("groupby") is not None:
+            raise ValueError("Cannot have both `aggregate` and `groupby` steps")
+
+        sort = values.get("sort")
+        has_sort_result = sort is not None and sort.limit is not None
+        if (
+            values.get("aggregate") is None
+            and values.get("groupby") is None
+            and not has_sort_result
+        ):
+            raise ValueError(
+                "Plan needs to end with an `aggregate`, `groupby` or a `sort` step with a limit"
+            )
+        return values